@@ -1,10 +1,22 @@
 import streamlit as st
-import pandas as pd
-from databricks import sql
-from databricks.sdk.core import Config
+import orjson
+import atexit
+import http.client
+import hashlib
+import io
 import os
+import queue
+import random
+import re
+import sys
+import time
 from datetime import datetime
+from decimal import Decimal
 import getpass
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 # Page configuration
 st.set_page_config(
@@ -13,23 +25,24 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize Databricks Config (automatically loads from environment variables)
-try:
-    cfg = Config()
-except Exception:
-    cfg = None  # Will be None in local development mode
+# Heavy dependencies (databricks-sql-connector, databricks-sdk, pyarrow,
+# zstandard) are imported inside the functions that use them, so the
+# welcome page renders without paying their import cost.
 
-# Function to check if running as Databricks App
-def is_databricks_app():
-    """Check if running as a Databricks App by looking for forwarded headers"""
-    try:
-        # Try to get Streamlit's request context
-        from streamlit.web.server.websocket_headers import _get_websocket_headers
-        headers = _get_websocket_headers()
-        return headers and ('X-Forwarded-Email' in headers or 'X-Forwarded-Access-Token' in headers)
-    except:
-        # Fallback: check environment or other indicators
-        return os.getenv('DATABRICKS_APP_MODE') == 'true'
+# Databricks Config (automatically loads from environment variables)
+@st.cache_resource(show_spinner=False)
+def get_config():
+    """Return the Databricks SDK Config (failures raise and are not cached)"""
+    from databricks.sdk.core import Config
+    
+    return Config()
+
+# Scheme prefix and trailing slashes stripped from workspace hosts
+HOST_CLEANUP_RE = re.compile(r"^https?://|/+$", re.IGNORECASE)
+
+def clean_host(host):
+    """Strip the scheme and trailing slashes from a workspace host in one pass"""
+    return HOST_CLEANUP_RE.sub("", host) if host else host
 
 # Function to get Databricks App user context
 def get_databricks_app_user():
@@ -57,8 +70,7 @@ def get_databricks_app_user():
             host = os.getenv('DATABRICKS_HOST', '')
         
         # Clean the host (remove https:// and trailing slashes)
-        if host:
-            host = host.replace('https://', '').replace('http://', '').rstrip('/')
+        host = clean_host(host)
         
         return {
             'email': email,
@@ -75,22 +87,646 @@ def get_databricks_app_user():
             'is_databricks_app': False
         }
 
+def release_conn(pooled):
+    """Close a pooled connection evicted from the cache once its in-flight query (if any) finishes"""
+    def close():
+        with pooled['lock']:
+            try:
+                pooled['connection'].close()
+            except Exception:
+                pass
+    
+    # Evictions run under Streamlit's cache lock; don't hold it while a query finishes
+    threading.Thread(target=close, name="close-connection", daemon=True).start()
+
+# Pooled Databricks SQL connection (a closed connection is replaced on next use).
+# Bounded so stale users and rotated tokens don't keep warehouse sessions open;
+# evicted and expired connections are closed
+@st.cache_resource(
+    show_spinner=False,
+    ttl=3600,
+    max_entries=32,
+    validate=lambda pooled: pooled['connection'].open,
+    on_release=release_conn
+)
+def get_conn(server_hostname, http_path, access_token):
+    """
+    Open a long-lived Databricks SQL connection shared across reruns.
+    
+    Streamlit caches one connection per (host, path, token), so each user keeps
+    their own connection and Unity Catalog permissions are still enforced.
+    A single cursor is opened with the connection and reused for every query,
+    so session settings persist and no cursor is allocated per query.
+    The SQL connector is not thread-safe, so callers must hold the returned
+    lock while using the cursor.
+    """
+    from databricks import sql
+    
+    connection = sql.connect(
+        server_hostname=server_hostname,
+        http_path=http_path,
+        access_token=access_token
+    )
+    try:
+        cursor = connection.cursor()
+        # Let repeated metadata and preview queries hit the warehouse result cache
+        cursor.execute("SET use_cached_result = true")
+    except Exception:
+        # Exceptions aren't cached, so each retry would open another session
+        connection.close()
+        raise
+    return {
+        'connection': connection,
+        'cursor': cursor,
+        'lock': threading.Lock()
+    }
+
+# Connection settings are checked locally before any network call
+HOSTNAME_RE = re.compile(r"^(https?://)?[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)+/?$")
+HTTP_PATH_RE = re.compile(r"^/sql/(1\.0/(warehouses|endpoints)/|protocolv1/o/)\S+$")
+
+def validate_conn(server_hostname, http_path, access_token, expect_pat=True):
+    """
+    Check connection settings without contacting Databricks.
+    
+    Returns (errors, warnings). Errors block the connection attempt; warnings
+    are shown but the connection is still tried. Personal access tokens start
+    with "dapi"; Databricks App tokens are OAuth tokens, so pass
+    expect_pat=False there.
+    """
+    errors = []
+    warnings = []
+    if not HOSTNAME_RE.match(server_hostname):
+        errors.append(f"Server hostname `{server_hostname}` is not a valid hostname (e.g. your-workspace.cloud.databricks.com)")
+    if not HTTP_PATH_RE.match(http_path):
+        errors.append(f"HTTP path `{http_path}` is not a SQL warehouse path (e.g. /sql/1.0/warehouses/abc123def456)")
+    if expect_pat and not access_token.startswith("dapi"):
+        warnings.append("Access token does not start with `dapi` - check it is a personal access token")
+    return errors, warnings
+
+@contextmanager
+def pooled_cursor(conn_key):
+    """
+    Hold the pooled connection's lock and yield its shared cursor.
+    
+    If the connection fails (OperationalError), it is closed so that the
+    next get_conn() call reconnects instead of reusing the broken session.
+    """
+    from databricks import sql
+    
+    pooled = get_conn(*conn_key)
+    with pooled['lock']:
+        try:
+            yield pooled['cursor']
+        except sql.OperationalError:
+            try:
+                pooled['connection'].close()
+            except Exception:
+                pass
+            raise
+
+# Control characters are never valid in Unity Catalog names
+INVALID_IDENTIFIER_RE = re.compile(r"[\x00-\x1f\x7f]")
+
+def quote_identifier(name):
+    """Backtick-quote a SQL identifier, escaping embedded backticks"""
+    if not name or INVALID_IDENTIFIER_RE.search(name):
+        raise ValueError(f"Invalid identifier: {name!r}")
+    return "`" + name.replace("`", "``") + "`"
+
+def qualified_name(*parts):
+    """Build a quoted catalog.schema.table style name"""
+    return ".".join(quote_identifier(part) for part in parts)
+
+# Selections preselected in the catalog/schema/table dropdowns when available
+DEFAULT_CATALOG = "samples"
+DEFAULT_SCHEMA = "nyctaxi"
+DEFAULT_TABLE = "trips"
+
+# Row filter operators offered in the UI (values are bound as query parameters)
+FILTER_OPERATORS = ["=", "!=", ">", ">=", "<", "<=", "LIKE", "IS NULL", "IS NOT NULL"]
+
+# Rows fetched per Arrow batch when loading data
+FETCH_BATCH_ROWS = 10000
+
+# Rows sent to the browser for the data preview (exports include every row)
+PREVIEW_ROWS = 200
+
+# Error text that marks a transient failure (warehouse cold start, dropped reads)
+RETRIABLE_ERROR_MARKERS = (
+    "503", "temporarily_unavailable", "service unavailable",
+    "incompleteread", "connection reset", "timed out"
+)
+
+# Troubleshooting hints for connection failures, checked in order against the
+# lowercased error message; the first matching marker wins
+CONNECTION_ERROR_HINTS = (
+    (("invalid access token", "401", "invalid_token"),
+     "💡 **Token Issue**: The access token may be expired or invalid.\n\n"
+     "**Solution**: Update your DATABRICKS_TOKEN environment variable"),
+    (("404", "not found"),
+     "💡 **Path Issue**: Check DATABRICKS_HTTP_PATH environment variable"),
+    (("host",),
+     "💡 **Host Issue**: Check DATABRICKS_SERVER_HOSTNAME environment variable"),
+    (("timeout", "timed out"),
+     "💡 **Timeout**: Connection timed out. Check:\n"
+     "1. SQL Warehouse is running\n"
+     "2. Network connectivity\n"
+     "3. Firewall settings"),
+)
+
+def connection_error_hint(error_msg):
+    """Return the troubleshooting hint for a connection error message, if any"""
+    message = error_msg.lower()
+    return next(
+        (hint for markers, hint in CONNECTION_ERROR_HINTS
+         if any(marker in message for marker in markers)),
+        None
+    )
+
+def is_retriable(error):
+    """Check whether a query error is transient and worth retrying"""
+    if isinstance(error, (http.client.IncompleteRead, ConnectionError, TimeoutError)):
+        return True
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in RETRIABLE_ERROR_MARKERS)
+
+def with_retry(fn, attempts=5, base=0.5):
+    """Call fn, retrying transient errors with exponential backoff and jitter"""
+    from databricks import sql
+    
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except (sql.Error, OSError, http.client.IncompleteRead) as e:
+            if attempt == attempts - 1 or not is_retriable(e):
+                raise
+            time.sleep(base * (2 ** attempt) + random.random() * 0.25)
+
+def fetch_column(conn_key, query, index=0):
+    """Run a query on the pooled connection and return one result column as a list"""
+    def run():
+        with pooled_cursor(conn_key) as cursor:
+            cursor.execute(query)
+            # Arrow keeps the column contiguous, so no per-row Row objects are built
+            return cursor.fetchall_arrow().column(index).to_pylist()
+    return with_retry(run)
+
+def fetch_table(conn_key, query, parameters):
+    """
+    Run a query on the pooled connection and return the result as an Arrow table.
+    
+    Rows are streamed in FETCH_BATCH_ROWS batches.
+    """
+    import pyarrow as pa
+    
+    def run():
+        with pooled_cursor(conn_key) as cursor:
+            cursor.execute(query, parameters)
+            batches = [cursor.fetchmany_arrow(FETCH_BATCH_ROWS)]
+            while batches[-1].num_rows:
+                batches.append(cursor.fetchmany_arrow(FETCH_BATCH_ROWS))
+        # Zero-copy: the table keeps the fetched batches as chunks
+        return pa.concat_tables(batches)
+    return with_retry(run)
+
+def hash_token(access_token):
+    """Short, non-reversible cache key for an access token"""
+    return hashlib.blake2b(access_token.encode(), digest_size=16).hexdigest()
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def load_table(token_hash, _conn_key, query, parameters):
+    """
+    Cached fetch_table: repeat loads of the same query skip the warehouse.
+    
+    Keyed on token_hash, so users never share cached rows. No Streamlit
+    elements may be touched in here: a cache hit replays element calls, which
+    fails for elements created outside the function.
+    """
+    return fetch_table(_conn_key, query, parameters)
+
+# Cached Unity Catalog metadata lookups. Results are keyed per user on
+# token_hash; _conn_key (which holds the raw token) is left out of the key.
+# metadata_gen changes when Refresh Metadata is clicked, so a refresh re-reads
+# metadata for that session only; other users' entries are left in place and
+# the superseded ones expire with the TTL
+@st.cache_data(ttl=300, show_spinner=False)
+def list_catalogs(token_hash, metadata_gen, _conn_key):
+    """Return catalog names visible to the connection's user"""
+    return fetch_column(_conn_key, "SHOW CATALOGS")
+
+@st.cache_data(ttl=300, show_spinner=False)
+def list_schemas(token_hash, metadata_gen, _conn_key, catalog):
+    """Return schema names in a catalog"""
+    return fetch_column(_conn_key, f"SHOW SCHEMAS IN {qualified_name(catalog)}")
+
+@st.cache_data(ttl=300, show_spinner=False)
+def list_tables(token_hash, metadata_gen, _conn_key, catalog, schema):
+    """Return table names in a schema"""
+    return fetch_column(_conn_key, f"SHOW TABLES IN {qualified_name(catalog, schema)}", index=1)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def list_columns(token_hash, metadata_gen, _conn_key, catalog, schema, table):
+    """Return column names of a table from DESCRIBE TABLE"""
+    columns = []
+    for name in fetch_column(_conn_key, f"DESCRIBE TABLE {qualified_name(catalog, schema, table)}"):
+        # Partition/metadata sections follow a blank or '#' row
+        if not name or name.startswith('#'):
+            break
+        columns.append(name)
+    return columns
+
+# Export serialization (works on the Arrow table without converting to pandas)
+def _json_default(value):
+    """Encode values orjson does not support natively (e.g. DECIMAL columns)"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+def flatten_nested_columns(table):
+    """
+    Replace ARRAY, STRUCT and MAP columns with their JSON text.
+    
+    The connector returns these as nested Arrow types, which pyarrow's CSV
+    writer rejects; values are encoded the same way as in the JSON export.
+    """
+    import pyarrow as pa
+    
+    for index, field in enumerate(table.schema):
+        if pa.types.is_nested(field.type):
+            values = [
+                None if value is None else orjson.dumps(value, default=_json_default).decode()
+                for value in table.column(index).to_pylist()
+            ]
+            table = table.set_column(index, field.name, pa.array(values, pa.string()))
+    return table
+
+def _build_csv(table):
+    """Serialize an Arrow table to CSV bytes"""
+    import pyarrow.csv as pa_csv
+    
+    buf = io.BytesIO()
+    pa_csv.write_csv(flatten_nested_columns(table), buf)
+    return buf.getvalue()
+
+def _build_json(table):
+    """Serialize an Arrow table to a JSON array of records, one batch at a time"""
+    # Write each batch's records straight into one buffer, without the
+    # batch array's brackets, instead of collecting chunks and joining them
+    buf = io.BytesIO()
+    buf.write(b"[")
+    for batch in table.to_batches(max_chunksize=65536):
+        if not batch.num_rows:
+            continue
+        if buf.tell() > 1:
+            buf.write(b",")
+        buf.write(memoryview(orjson.dumps(batch.to_pylist(), default=_json_default))[1:-1])
+    buf.write(b"]")
+    return buf.getvalue()
+
+def _build_ndjson(table):
+    """Serialize an Arrow table to newline-delimited JSON (one record per line)"""
+    buf = io.BytesIO()
+    for batch in table.to_batches(max_chunksize=65536):
+        for row in batch.to_pylist():
+            buf.write(orjson.dumps(row, default=_json_default, option=orjson.OPT_APPEND_NEWLINE))
+    return buf.getvalue()
+
+# Export payloads, cached per load generation so reruns don't re-serialize.
+# Each entry only serves the session that loaded it, so it expires after five
+# minutes (rebuilt from the loaded table if needed) rather than outliving the session.
+# The leading underscores keep Streamlit from hashing the table and _pending,
+# a background build from precompute_exports to collect instead of building
+@st.cache_data(ttl=300, show_spinner=False, max_entries=8)
+def to_csv_bytes(data_gen, _table, _pending=None):
+    """CSV export of a load"""
+    return _pending.result() if _pending is not None else _build_csv(_table)
+
+@st.cache_data(ttl=300, show_spinner=False, max_entries=8)
+def to_csv_zst_bytes(data_gen, _table, _pending=None):
+    """zstd-compressed CSV export of a load"""
+    import zstandard
+    
+    return zstandard.ZstdCompressor(level=3).compress(to_csv_bytes(data_gen, _table, _pending))
+
+@st.cache_data(ttl=300, show_spinner=False, max_entries=8)
+def to_json_bytes(data_gen, _table, _pending=None):
+    """JSON array export of a load"""
+    return _pending.result() if _pending is not None else _build_json(_table)
+
+@st.cache_data(ttl=300, show_spinner=False, max_entries=8)
+def to_ndjson_bytes(data_gen, _table, _pending=None):
+    """NDJSON export of a load"""
+    return _pending.result() if _pending is not None else _build_ndjson(_table)
+
+@st.cache_resource
+def get_export_executor():
+    """Worker threads that build the CSV and JSON exports side by side"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="export-build")
+
+def precompute_exports(table, ndjson):
+    """
+    Start building the CSV and the selected JSON export in parallel.
+    
+    Called when the Terms are accepted. The futures only run the plain
+    builders (no Streamlit calls off the script thread); they are handed to
+    the cached to_*_bytes functions in the same run and not kept afterwards.
+    """
+    executor = get_export_executor()
+    return {
+        'csv': executor.submit(_build_csv, table),
+        'json': executor.submit(_build_ndjson if ndjson else _build_json, table)
+    }
+
+# Audit events that are always written in full, never collapsed into a repeat count
+AUDIT_DEDUP_EXEMPT = ("CONNECTION_SUCCESS", "TERMS_ACCEPTED")
+
+# Maximum audit records waiting for the writer thread; newer events are dropped
+# (and counted) when it is full rather than blocking the page
+AUDIT_QUEUE_SIZE = 10000
+
+# Buffered audit output is written to stdout in a single os.write once it
+# reaches AUDIT_BUFFER_BYTES, or AUDIT_FLUSH_INTERVAL seconds after the last write
+AUDIT_BUFFER_BYTES = 65536
+AUDIT_FLUSH_INTERVAL = 1.0
+
+class AuditBuffer:
+    """
+    Collect formatted audit lines into a buffer that is written in batches.
+    
+    Only the writer thread touches it. Consecutive identical events are
+    collapsed: the first is written, later repeats only bump a counter that is
+    written as a "REPEATED xN" line when a different event arrives or on the
+    next flush.
+    """
+    
+    def __init__(self):
+        self.data = bytearray()
+        self.last_key = None
+        self.repeats = 0
+    
+    def add(self, key, line):
+        """Buffer one (key, line) audit record, collapsing consecutive repeats"""
+        event_type = key[0]
+        if event_type not in AUDIT_DEDUP_EXEMPT and key == self.last_key:
+            self.repeats += 1
+            return
+        self.write_repeat_summary()
+        self.data += (line + "\n").encode("utf-8")
+        self.last_key = None if event_type in AUDIT_DEDUP_EXEMPT else key
+    
+    def write_repeat_summary(self):
+        """Buffer the pending repeat count for the last event"""
+        if self.repeats:
+            event_type, details, username = self.last_key
+            timestamp = datetime.now().isoformat(timespec='milliseconds')
+            self.data += (
+                f"[{timestamp}] USER={username} EVENT={event_type} DETAILS={details} REPEATED x{self.repeats}\n"
+            ).encode("utf-8")
+            self.repeats = 0
+    
+    def flush(self):
+        """Write the buffered lines to stdout; anything not written stays buffered"""
+        self.write_repeat_summary()
+        if not self.data:
+            return
+        written = 0
+        try:
+            # One write(2) per batch; loop only if a pipe takes it in parts
+            fd = sys.stdout.fileno()
+            with memoryview(self.data) as view:
+                while written < len(view):
+                    written += os.write(fd, view[written:])
+        except (OSError, ValueError, AttributeError):
+            # No usable file descriptor (stdout redirected to a Python stream)
+            # or the write failed: hand the rest to the text stream instead
+            sys.stdout.write(self.data[written:].decode("utf-8", errors="replace"))
+            sys.stdout.flush()
+            written = len(self.data)
+        finally:
+            del self.data[:written]
+
+def make_audit_record(event_type, details, username):
+    """Build the (dedup key, log line) pair for one audit event"""
+    timestamp = datetime.now().isoformat(timespec='milliseconds')
+    return (
+        (event_type, details, username),
+        f"[{timestamp}] USER={username} EVENT={event_type} DETAILS={details}"
+    )
+
+# Audit log pipeline shared by all sessions
+@st.cache_resource(show_spinner=False)
+def get_audit_writer():
+    """
+    Start the process-wide audit log pipeline.
+    
+    log_audit_event only puts a record on a bounded queue. A writer thread
+    drains it into an AuditBuffer and writes the buffer to stdout
+    once it holds AUDIT_BUFFER_BYTES or AUDIT_FLUSH_INTERVAL has passed,
+    reporting any events dropped because the queue was full. Everything is
+    drained at exit. The local username is resolved once here rather than
+    on every event.
+    """
+    try:
+        local_user = getpass.getuser()
+    except Exception:
+        local_user = "unknown"
+    
+    audit_queue = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+    buffer = AuditBuffer()
+    stop = object()
+    
+    writer = {
+        'queue': audit_queue,
+        'local_user': local_user,
+        'dropped': 0,
+        'dropped_lock': threading.Lock()
+    }
+    
+    def flush():
+        with writer['dropped_lock']:
+            dropped, writer['dropped'] = writer['dropped'], 0
+        if dropped:
+            buffer.add(*make_audit_record("AUDIT_EVENTS_DROPPED", f"count={dropped}", local_user))
+        buffer.flush()
+    
+    def drain():
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, AUDIT_FLUSH_INTERVAL - (time.monotonic() - last_flush))
+            try:
+                record = audit_queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+            try:
+                if record is not None and record is not stop:
+                    buffer.add(*record)
+                if (record is stop
+                        or len(buffer.data) >= AUDIT_BUFFER_BYTES
+                        or time.monotonic() - last_flush >= AUDIT_FLUSH_INTERVAL):
+                    last_flush = time.monotonic()
+                    flush()
+            except Exception:
+                # A failed write must not end the writer thread (it is never
+                # restarted); unwritten lines stay buffered for the next flush
+                pass
+            if record is stop:
+                return
+    
+    thread = threading.Thread(target=drain, name="audit-log-writer", daemon=True)
+    thread.start()
+    
+    def shutdown():
+        audit_queue.put(stop)
+        thread.join(timeout=5)
+    
+    atexit.register(shutdown)
+    return writer
+
 # Audit logging function
 def log_audit_event(event_type, details, user_email=None):
     """Log data access and export events for compliance to stdout"""
     try:
-        timestamp = datetime.now().isoformat()
-        username = user_email or getpass.getuser()
+        writer = get_audit_writer()
+        username = user_email or writer['local_user']
         
-        log_entry = f"[{timestamp}] USER={username} EVENT={event_type} DETAILS={details}"
-        
-        # Log to stdout for Databricks App logging
-        print(log_entry)
+        # Hand off to the writer thread for Databricks App logging; never block
+        try:
+            writer['queue'].put_nowait(make_audit_record(event_type, details, username))
+        except queue.Full:
+            with writer['dropped_lock']:
+                writer['dropped'] += 1
     except Exception as e:
         # Silently fail - don't break the app if logging fails
         pass
 
 
+# Data export terms shown until the user accepts them for the loaded data
+TERMS_TEXT = """
+### Data Export Terms and Conditions
+
+By downloading data from this application, you acknowledge and agree to the following:
+
+1. **Data Usage**: The exported data is intended for authorized business purposes only.
+
+2. **Confidentiality**: You will maintain the confidentiality of any sensitive or proprietary information contained in the exported data.
+
+3. **Compliance**: You will comply with all applicable data protection laws and regulations, including but not limited to GDPR, CCPA, and HIPAA (where applicable).
+
+4. **Security**: You are responsible for securing the downloaded data and preventing unauthorized access.
+
+5. **No Redistribution**: You will not redistribute, share, or publish the exported data without proper authorization.
+
+6. **Audit Trail**: All data exports are logged and may be subject to audit for compliance purposes.
+
+7. **Access Rights**: You confirm that you have the appropriate permissions and access rights to export this data.
+
+8. **Liability**: Misuse of exported data may result in disciplinary action and/or legal consequences.
+
+---
+
+**By checking the box below, you certify that you have read, understood, and agree to these terms.**
+"""
+
+# Terms of Use and download buttons, rerun on their own when the checkbox changes
+@st.fragment
+def export_panel(table_name, file_stem, user_email):
+    """Render the Terms of Use acceptance and the export download buttons"""
+    # Background builds started by accepting the Terms in this run
+    pending = {}
+    
+    # Terms of Use Section
+    with st.expander("📜 **Terms of Use** (Must Accept to Download)", expanded=not st.session_state.terms_accepted):
+        # Full terms only while acceptance is pending; once accepted the
+        # (collapsed) expander just confirms it. Load Data clears both the
+        # acceptance and the checkbox, so each new load shows them again
+        if st.session_state.terms_accepted:
+            st.caption("Terms of Use accepted for the loaded data.")
+        else:
+            st.markdown(TERMS_TEXT)
+        
+        terms_checkbox = st.checkbox(
+            "✅ I accept the Terms of Use and agree to handle exported data responsibly",
+            value=st.session_state.terms_accepted,
+            key="terms_checkbox"
+        )
+        
+        if terms_checkbox != st.session_state.terms_accepted:
+            st.session_state.terms_accepted = terms_checkbox
+            if terms_checkbox:
+                # Log terms acceptance
+                log_audit_event(
+                    "TERMS_ACCEPTED",
+                    f"table={table_name}, rows={st.session_state.stats['rows']}",
+                    user_email=user_email
+                )
+                # Build CSV and JSON side by side unless this load's exports
+                # were already built (e.g. terms unticked and ticked again)
+                if st.session_state.get('exports_built') != st.session_state.data_gen:
+                    pending = precompute_exports(
+                        st.session_state.data_arrow, st.session_state.get('ndjson_export', False)
+                    )
+                    st.session_state.exports_built = st.session_state.data_gen
+                st.success("✅ Terms accepted. You may now download data.")
+            else:
+                st.warning("⚠️ You must accept the terms to download data.")
+    
+    if not st.session_state.terms_accepted:
+        st.warning("⚠️ **Please accept the Terms of Use above to enable data downloads.**")
+    
+    col_export1, col_export2 = st.columns(2)
+    
+    # Payloads are only serialized once terms are accepted; the disabled
+    # buttons shown before that get an empty placeholder
+    terms_accepted = st.session_state.terms_accepted
+    
+    with col_export1:
+        # CSV export (optionally zstd-compressed to cut download size)
+        compression = st.radio("Compression", ["none", "zstd"], horizontal=True, key="csv_compression")
+        try:
+            if not terms_accepted:
+                csv = b""
+            elif compression == "zstd":
+                csv = to_csv_zst_bytes(st.session_state.data_gen, st.session_state.data_arrow, pending.get('csv'))
+            else:
+                csv = to_csv_bytes(st.session_state.data_gen, st.session_state.data_arrow, pending.get('csv'))
+        except Exception as e:
+            st.error(f"❌ Error preparing CSV export: {str(e)}")
+            csv = None
+        st.download_button(
+            label="Download as CSV" if st.session_state.terms_accepted else "🔒 Accept Terms to Download CSV",
+            data=csv or b"",
+            file_name=f"{file_stem}.csv.zst" if compression == "zstd" else f"{file_stem}.csv",
+            mime="application/zstd" if compression == "zstd" else "text/csv",
+            disabled=not st.session_state.terms_accepted or csv is None,
+            type="primary" if st.session_state.terms_accepted else "secondary"
+        )
+    
+    with col_export2:
+        # JSON export (NDJSON is smaller and easier to stream for large exports)
+        ndjson = st.toggle("NDJSON (one record per line)", key="ndjson_export")
+        try:
+            if not terms_accepted:
+                json = b""
+            elif ndjson:
+                json = to_ndjson_bytes(st.session_state.data_gen, st.session_state.data_arrow, pending.get('json'))
+            else:
+                json = to_json_bytes(st.session_state.data_gen, st.session_state.data_arrow, pending.get('json'))
+        except Exception as e:
+            st.error(f"❌ Error preparing JSON export: {str(e)}")
+            json = None
+        st.download_button(
+            label="Download as JSON" if st.session_state.terms_accepted else "🔒 Accept Terms to Download JSON",
+            data=json or b"",
+            file_name=f"{file_stem}.ndjson" if ndjson else f"{file_stem}.json",
+            mime="application/x-ndjson" if ndjson else "application/json",
+            disabled=not st.session_state.terms_accepted or json is None,
+            type="primary" if st.session_state.terms_accepted else "secondary"
+        )
+    
+    if st.session_state.terms_accepted:
+        st.caption("📋 Note: Data exports are logged for compliance and security purposes.")
+
 # Title and description
 st.title("🔒 Data Loss Prevention App")
 st.markdown("Export data from Unity Catalog tables with ease")
@@ -98,11 +734,18 @@ st.markdown("Export data from Unity Catalog tables with ease")
 # Sidebar for connection settings
 st.sidebar.header("Databricks Connection")
 
-# Check if running as Databricks App
-user_context = get_databricks_app_user()
+# Check if running as Databricks App (headers don't change within a session)
+if 'user_context' not in st.session_state:
+    st.session_state.user_context = get_databricks_app_user()
+user_context = st.session_state.user_context
 is_databricks_app_mode = user_context['is_databricks_app']
 warehouse_id = os.getenv('DATABRICKS_WAREHOUSE_ID')
 
+try:
+    cfg = get_config() if is_databricks_app_mode else None
+except Exception:
+    cfg = None  # Local development mode until a later rerun gets a Config
+
 if is_databricks_app_mode and cfg:
     # Databricks App mode - use forwarded credentials and Config
     st.sidebar.success("🎯 **Databricks App Mode**")
@@ -110,7 +753,7 @@ if is_databricks_app_mode and cfg:
     st.sidebar.caption("Using your Databricks credentials automatically")
     
     auth_method = "Databricks App"
-    server_hostname = cfg.host
+    server_hostname = clean_host(cfg.host)
     access_token = user_context['token']
     
     # Build HTTP path from warehouse_id
@@ -126,14 +769,13 @@ else:
     auth_method = "Environment Variables"
     
     # Read from environment variables
-    server_hostname = os.getenv("DATABRICKS_SERVER_HOSTNAME", "")
+    server_hostname = clean_host(os.getenv("DATABRICKS_SERVER_HOSTNAME", ""))
     http_path = os.getenv("DATABRICKS_HTTP_PATH", "")
     access_token = os.getenv("DATABRICKS_TOKEN", "")
     
     # Show status
     if server_hostname and http_path and access_token:
         st.sidebar.success("✅ Environment variables detected")
-        st.sidebar.caption(f"Host: `{server_hostname}`")
     else:
         st.sidebar.error("⚠️ Missing environment variables")
         missing = []
@@ -142,34 +784,55 @@ else:
         if not access_token: missing.append("DATABRICKS_TOKEN")
         st.sidebar.code(f"Missing: {', '.join(missing)}")
 
-# Initialize session state
-if 'connection' not in st.session_state:
-    st.session_state.connection = None
-if 'catalogs' not in st.session_state:
-    st.session_state.catalogs = []
-if 'schemas' not in st.session_state:
-    st.session_state.schemas = []
-if 'tables' not in st.session_state:
-    st.session_state.tables = []
-if 'data' not in st.session_state:
-    st.session_state.data = None
-if 'terms_accepted' not in st.session_state:
-    st.session_state.terms_accepted = False
+# Connection details are only shown when debugging
+st.sidebar.toggle("Debug", key="debug", help="Show connection details")
+if st.session_state.debug:
+    st.sidebar.code(f"host={server_hostname}\npath={http_path}")
 
-# Auto-connect if credentials are available
+# Initialize session state (empty tuples avoid allocating lists on every rerun)
+SESSION_DEFAULTS = (
+    ('connection', None),
+    ('catalogs', ()),
+    ('schemas', ()),
+    ('tables', ()),
+    ('data_arrow', None),
+    ('terms_accepted', False),
+    ('metadata_gen', None)
+)
+for key, value in SESSION_DEFAULTS:
+    st.session_state.setdefault(key, value)
+
+# Drop the pooled connection (e.g. after the token expired) and reconnect
+if server_hostname and http_path and access_token:
+    if st.sidebar.button("🔄 Reset Connection", help="Reconnect if queries fail with authentication errors"):
+        # Only this user's connection is dropped (and closed)
+        get_conn.clear(server_hostname, http_path, access_token)
+        st.session_state.connection = None
+
+# Validate settings locally so misconfiguration is reported without a network round trip
+conn_errors = []
 if server_hostname and http_path and access_token and not st.session_state.connection:
+    conn_errors, conn_warnings = validate_conn(
+        server_hostname, http_path, access_token, expect_pat=not is_databricks_app_mode
+    )
+    for message in conn_errors:
+        st.sidebar.error(f"⚠️ {message}")
+    for message in conn_warnings:
+        st.sidebar.warning(f"💡 {message}")
+
+# Auto-connect if credentials are available
+if server_hostname and http_path and access_token and not conn_errors and not st.session_state.connection:
     try:
         with st.spinner("Connecting to Databricks..."):
-            # Connect to Databricks using the user's access token
-            with sql.connect(
-                server_hostname=server_hostname,
-                http_path=http_path,
-                access_token=access_token
-            ) as connection:
-                with connection.cursor() as cursor:
-                    # Test connection and fetch catalogs
-                    cursor.execute("SHOW CATALOGS")
-                    st.session_state.catalogs = [row[0] for row in cursor.fetchall()]
+            # Connect to Databricks using the user's access token,
+            # testing the connection by fetching catalogs
+            # Hash the token once per connection; cached lookups are keyed on it
+            st.session_state.token_hash = hash_token(access_token)
+            st.session_state.catalogs = list_catalogs(
+                st.session_state.token_hash,
+                st.session_state.metadata_gen,
+                (server_hostname, http_path, access_token)
+            )
             
             # Store connection details for later queries
             st.session_state.connection_config = {
@@ -194,22 +857,28 @@ if server_hostname and http_path and access_token and not st.session_state.conne
         st.sidebar.error(f"❌ Connection failed: {error_msg}")
         
         # Provide helpful hints
-        if "Invalid access token" in error_msg or "401" in error_msg or "INVALID_TOKEN" in error_msg:
-            st.sidebar.warning("💡 **Token Issue**: The access token may be expired or invalid.\n\n"
-                               "**Solution**: Update your DATABRICKS_TOKEN environment variable")
-        elif "404" in error_msg or "not found" in error_msg.lower():
-            st.sidebar.warning("💡 **Path Issue**: Check DATABRICKS_HTTP_PATH environment variable")
-        elif "host" in error_msg.lower() or "hostname" in error_msg.lower():
-            st.sidebar.warning("💡 **Host Issue**: Check DATABRICKS_SERVER_HOSTNAME environment variable")
-        elif "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
-            st.sidebar.warning("💡 **Timeout**: Connection timed out. Check:\n"
-                               "1. SQL Warehouse is running\n"
-                               "2. Network connectivity\n"
-                               "3. Firewall settings")
+        hint = connection_error_hint(error_msg)
+        if hint:
+            st.sidebar.warning(hint)
 
 # Main content
 if st.session_state.connection and 'connection_config' in st.session_state:
     config = st.session_state.connection_config
+    conn_key = (config['server_hostname'], config['http_path'], config['access_token'])
+    token_hash = st.session_state.token_hash
+    
+    # Re-read catalogs, schemas, and tables from the warehouse. A new generation
+    # id skips this user's cached lookups without clearing other users' entries
+    if st.sidebar.button("🔄 Refresh Metadata", help="Reload catalogs, schemas, and tables"):
+        st.session_state.metadata_gen = uuid.uuid4().hex
+        st.session_state.last_catalog = None
+        st.session_state.last_schema = None
+        try:
+            st.session_state.catalogs = list_catalogs(token_hash, st.session_state.metadata_gen, conn_key)
+        except Exception as e:
+            st.sidebar.error(f"Error refreshing catalogs: {str(e)}")
+    
+    metadata_gen = st.session_state.metadata_gen
     
     col1, col2, col3 = st.columns(3)
     
@@ -217,8 +886,8 @@ if st.session_state.connection and 'connection_config' in st.session_state:
     with col1:
         # Default to "samples" if available
         default_catalog_index = 0
-        if "samples" in st.session_state.catalogs:
-            default_catalog_index = st.session_state.catalogs.index("samples")
+        if DEFAULT_CATALOG in st.session_state.catalogs:
+            default_catalog_index = st.session_state.catalogs.index(DEFAULT_CATALOG)
         
         selected_catalog = st.selectbox(
             "Select Catalog",
@@ -230,19 +899,19 @@ if st.session_state.connection and 'connection_config' in st.session_state:
     # Schema selector
     with col2:
         if selected_catalog:
-            try:
-                with sql.connect(**config) as connection:
-                    with connection.cursor() as cursor:
-                        cursor.execute(f"SHOW SCHEMAS IN {selected_catalog}")
-                        st.session_state.schemas = [row[0] for row in cursor.fetchall()]
-            except Exception as e:
-                st.error(f"Error fetching schemas: {str(e)}")
-                st.session_state.schemas = []
+            # Only look up schemas when the catalog selection changes
+            if st.session_state.get('last_catalog') != selected_catalog:
+                try:
+                    st.session_state.schemas = list_schemas(token_hash, metadata_gen, conn_key, selected_catalog)
+                    st.session_state.last_catalog = selected_catalog
+                except Exception as e:
+                    st.error(f"Error fetching schemas: {str(e)}")
+                    st.session_state.schemas = []
             
             # Default to "nyctaxi" if available
             default_schema_index = 0
-            if "nyctaxi" in st.session_state.schemas:
-                default_schema_index = st.session_state.schemas.index("nyctaxi")
+            if DEFAULT_SCHEMA in st.session_state.schemas:
+                default_schema_index = st.session_state.schemas.index(DEFAULT_SCHEMA)
             
             selected_schema = st.selectbox(
                 "Select Schema",
@@ -256,19 +925,19 @@ if st.session_state.connection and 'connection_config' in st.session_state:
     # Table selector
     with col3:
         if selected_catalog and selected_schema:
-            try:
-                with sql.connect(**config) as connection:
-                    with connection.cursor() as cursor:
-                        cursor.execute(f"SHOW TABLES IN {selected_catalog}.{selected_schema}")
-                        st.session_state.tables = [row[1] for row in cursor.fetchall()]
-            except Exception as e:
-                st.error(f"Error fetching tables: {str(e)}")
-                st.session_state.tables = []
+            # Only look up tables when the catalog/schema selection changes
+            if st.session_state.get('last_schema') != (selected_catalog, selected_schema):
+                try:
+                    st.session_state.tables = list_tables(token_hash, metadata_gen, conn_key, selected_catalog, selected_schema)
+                    st.session_state.last_schema = (selected_catalog, selected_schema)
+                except Exception as e:
+                    st.error(f"Error fetching tables: {str(e)}")
+                    st.session_state.tables = []
             
             # Default to "trips" if available
             default_table_index = 0
-            if "trips" in st.session_state.tables:
-                default_table_index = st.session_state.tables.index("trips")
+            if DEFAULT_TABLE in st.session_state.tables:
+                default_table_index = st.session_state.tables.index(DEFAULT_TABLE)
             
             selected_table = st.selectbox(
                 "Select Table",
@@ -290,133 +959,113 @@ if st.session_state.connection and 'connection_config' in st.session_state:
         with col_b:
             row_limit = st.number_input("Row Limit", min_value=1, max_value=100000, value=10)
         
-        if st.button("Load Data", type="primary"):
+        # Column selection - only the chosen columns are fetched from the warehouse
+        try:
+            all_columns = list_columns(token_hash, metadata_gen, conn_key, selected_catalog, selected_schema, selected_table)
+        except Exception as e:
+            st.error(f"Error fetching columns: {str(e)}")
+            all_columns = []
+        
+        selected_columns = st.multiselect("Columns", options=all_columns, default=all_columns)
+        
+        # Optional row filter, evaluated by the warehouse
+        with st.expander("🔎 Filter Rows (optional)"):
+            col_f1, col_f2, col_f3 = st.columns([2, 1, 2])
+            with col_f1:
+                filter_column = st.selectbox("Column", options=["(none)"] + all_columns)
+            with col_f2:
+                filter_operator = st.selectbox("Operator", options=FILTER_OPERATORS)
+            with col_f3:
+                filter_value = st.text_input(
+                    "Value",
+                    disabled=filter_operator in ("IS NULL", "IS NOT NULL")
+                )
+        
+        if all_columns and not selected_columns:
+            st.warning("⚠️ Select at least one column to load.")
+        
+        if st.button("Load Data", type="primary", disabled=bool(all_columns) and not selected_columns):
             try:
                 with st.spinner(f"Loading data from {selected_table}..."):
-                    query = f"SELECT * FROM {selected_catalog}.{selected_schema}.{selected_table} LIMIT {row_limit}"
+                    # Push projection and filter down to the warehouse
+                    if selected_columns and len(selected_columns) < len(all_columns):
+                        column_list = ", ".join(quote_identifier(c) for c in selected_columns)
+                    else:
+                        column_list = "*"
+                    # Identifiers are quoted; values (including the limit) are bound
+                    # parameters so the statement text doesn't change with them
+                    query = f"SELECT {column_list} FROM {qualified_name(selected_catalog, selected_schema, selected_table)}"
+                    parameters = {'row_limit': int(row_limit)}
+                    if filter_column != "(none)":
+                        if filter_operator in ("IS NULL", "IS NOT NULL"):
+                            query += f" WHERE {quote_identifier(filter_column)} {filter_operator}"
+                        else:
+                            query += f" WHERE {quote_identifier(filter_column)} {filter_operator} :filter_value"
+                            parameters['filter_value'] = filter_value
+                    query += " LIMIT :row_limit"
+                    
+                    # Query with user's token on the pooled connection, streaming
+                    # Arrow batches; keep the Arrow table for display and export.
+                    # Repeat loads of the same query within a minute come from cache
+                    st.session_state.data_arrow = load_table(token_hash, conn_key, query, parameters)
+                    
+                    # New generation id so cached exports are rebuilt for this data
+                    st.session_state.data_gen = uuid.uuid4().hex
                     
-                    # Query with user's token using context manager
-                    with sql.connect(**config) as connection:
-                        with connection.cursor() as cursor:
-                            cursor.execute(query)
-                            # Use fetchall_arrow for better performance
-                            result = cursor.fetchall_arrow().to_pandas()
-                            st.session_state.data = result
+                    # Compute statistics once here instead of on every rerun
+                    st.session_state.stats = {
+                        'rows': st.session_state.data_arrow.num_rows,
+                        'cols': st.session_state.data_arrow.num_columns,
+                        'mem_mb': st.session_state.data_arrow.nbytes / 1048576
+                    }
                     
                     # Reset terms acceptance when loading new data
                     st.session_state.terms_accepted = False
+                    st.session_state.terms_checkbox = False
                     
                     # Log data access
                     user_email = user_context.get('email') if is_databricks_app_mode else None
                     log_audit_event(
                         "DATA_LOADED",
-                        f"table={selected_catalog}.{selected_schema}.{selected_table}, rows={len(st.session_state.data)}, columns={len(st.session_state.data.columns)}",
+                        f"table={selected_catalog}.{selected_schema}.{selected_table}, rows={st.session_state.stats['rows']}, columns={st.session_state.stats['cols']}",
                         user_email=user_email
                     )
                     
-                    st.success(f"✅ Loaded {len(st.session_state.data)} rows")
+                    st.success(f"✅ Loaded {st.session_state.stats['rows']} rows")
             except Exception as e:
                 st.error(f"❌ Error loading data: {str(e)}")
         
         # Display data
-        if st.session_state.data is not None:
-            st.dataframe(data=st.session_state.data, height=400, use_container_width=True)
+        if st.session_state.data_arrow is not None:
+            # Preview the first PREVIEW_ROWS only; exports always include every row
+            total_rows = st.session_state.stats['rows']
+            st.dataframe(
+                data=st.session_state.data_arrow.slice(0, PREVIEW_ROWS),
+                height=400,
+                use_container_width=True
+            )
+            if total_rows > PREVIEW_ROWS:
+                st.caption(f"Showing first {PREVIEW_ROWS:,} of {total_rows:,} rows - full data available via download")
             
             # Export options with Terms of Use
             st.divider()
             st.subheader("📥 Export Data")
-            
-            # Terms of Use Section
-            with st.expander("📜 **Terms of Use** (Must Accept to Download)", expanded=not st.session_state.terms_accepted):
-                st.markdown("""
-                ### Data Export Terms and Conditions
-                
-                By downloading data from this application, you acknowledge and agree to the following:
-                
-                1. **Data Usage**: The exported data is intended for authorized business purposes only.
-                
-                2. **Confidentiality**: You will maintain the confidentiality of any sensitive or proprietary information contained in the exported data.
-                
-                3. **Compliance**: You will comply with all applicable data protection laws and regulations, including but not limited to GDPR, CCPA, and HIPAA (where applicable).
-                
-                4. **Security**: You are responsible for securing the downloaded data and preventing unauthorized access.
-                
-                5. **No Redistribution**: You will not redistribute, share, or publish the exported data without proper authorization.
-                
-                6. **Audit Trail**: All data exports are logged and may be subject to audit for compliance purposes.
-                
-                7. **Access Rights**: You confirm that you have the appropriate permissions and access rights to export this data.
-                
-                8. **Liability**: Misuse of exported data may result in disciplinary action and/or legal consequences.
-                
-                ---
-                
-                **By checking the box below, you certify that you have read, understood, and agree to these terms.**
-                """)
-                
-                terms_checkbox = st.checkbox(
-                    "✅ I accept the Terms of Use and agree to handle exported data responsibly",
-                    value=st.session_state.terms_accepted,
-                    key="terms_checkbox"
-                )
-                
-                if terms_checkbox != st.session_state.terms_accepted:
-                    st.session_state.terms_accepted = terms_checkbox
-                    if terms_checkbox:
-                        # Log terms acceptance
-                        user_email = user_context.get('email') if is_databricks_app_mode else None
-                        log_audit_event(
-                            "TERMS_ACCEPTED",
-                            f"table={selected_catalog}.{selected_schema}.{selected_table}, rows={len(st.session_state.data)}",
-                            user_email=user_email
-                        )
-                        st.success("✅ Terms accepted. You may now download data.")
-                    else:
-                        st.warning("⚠️ You must accept the terms to download data.")
-            
-            if not st.session_state.terms_accepted:
-                st.warning("⚠️ **Please accept the Terms of Use above to enable data downloads.**")
-            
-            col_export1, col_export2 = st.columns(2)
-            
-            with col_export1:
-                # CSV export
-                csv = st.session_state.data.to_csv(index=False)
-                st.download_button(
-                    label="Download as CSV" if st.session_state.terms_accepted else "🔒 Accept Terms to Download CSV",
-                    data=csv,
-                    file_name=f"{selected_table}.csv",
-                    mime="text/csv",
-                    disabled=not st.session_state.terms_accepted,
-                    type="primary" if st.session_state.terms_accepted else "secondary"
-                )
-            
-            with col_export2:
-                # JSON export
-                json = st.session_state.data.to_json(orient='records', indent=2)
-                st.download_button(
-                    label="Download as JSON" if st.session_state.terms_accepted else "🔒 Accept Terms to Download JSON",
-                    data=json,
-                    file_name=f"{selected_table}.json",
-                    mime="application/json",
-                    disabled=not st.session_state.terms_accepted,
-                    type="primary" if st.session_state.terms_accepted else "secondary"
-                )
-            
-            if st.session_state.terms_accepted:
-                st.caption("📋 Note: Data exports are logged for compliance and security purposes.")
+            export_panel(
+                f"{selected_catalog}.{selected_schema}.{selected_table}",
+                selected_table,
+                user_context.get('email') if is_databricks_app_mode else None
+            )
             
             # Display stats
             st.divider()
             st.subheader("📈 Data Statistics")
             col_stat1, col_stat2, col_stat3 = st.columns(3)
             with col_stat1:
-                st.metric("Total Rows", len(st.session_state.data))
+                st.metric("Total Rows", st.session_state.stats['rows'])
             with col_stat2:
-                st.metric("Total Columns", len(st.session_state.data.columns))
+                st.metric("Total Columns", st.session_state.stats['cols'])
             with col_stat3:
-                memory_usage = st.session_state.data.memory_usage(deep=True).sum() / 1024 / 1024
-                st.metric("Memory Usage", f"{memory_usage:.2f} MB")
+                st.metric("Memory Usage", f"{st.session_state.stats['mem_mb']:.2f} MB")
 
 else:
     if is_databricks_app_mode: